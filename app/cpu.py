@@ -0,0 +1,40 @@
+"""CPU sizing helpers shared by the model services when running several uvicorn workers.
+
+Kept outside app.services so main.py can pin cores before the services (and their
+thread pools) are imported.
+"""
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def web_workers() -> int:
+    return max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+
+def worker_threads() -> int:
+    """Threads one worker process should give a model: OMP_NUM_THREADS if set, otherwise
+    this process's share of the cores, so N workers do not oversubscribe the machine."""
+    if os.getenv("OMP_NUM_THREADS"):
+        return max(1, int(os.environ["OMP_NUM_THREADS"]))
+    return max(1, (os.cpu_count() or 1) // web_workers())
+
+
+def pin_worker():
+    """Pin this process to its own slice of cores when UVICORN_WORKER_ID is set (Linux only).
+
+    uvicorn does not number its workers, so the id has to be provided by a launcher that
+    starts each worker as its own process (e.g. one `UVICORN_WORKER_ID=i uvicorn ...` per
+    worker); `run.py` drops the variable when it forks several workers itself.
+    Call before any model threads are created; they inherit the affinity.
+    """
+    worker_id = os.getenv("UVICORN_WORKER_ID")
+    if worker_id is None or not hasattr(os, "sched_setaffinity"):
+        return
+    cores = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cores) // web_workers())
+    start = (int(worker_id) * per_worker) % len(cores)
+    core_set = set(cores[start:start + per_worker])
+    os.sched_setaffinity(0, core_set)
+    logger.info("Worker %s pinned to cores %s", worker_id, sorted(core_set))
@@ -1,30 +1,138 @@
-from typing import List, Dict
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Tuple
 from uuid import uuid4
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# oldest sessions are evicted beyond this many
+MAX_SESSIONS = 10_000
+# only the most recent messages of a session are kept
+MAX_MESSAGES = 64
+# once over MAX_MESSAGES this many of the oldest are dropped at once, so the prompt prefix
+# (and the LLM's cached KV state for it) only changes every TRIM_BLOCK messages, not every turn
+TRIM_BLOCK = 16
+
+# (role, text, unix timestamp)
+Message = Tuple[str, str, float]
+
+
 class HistoryManager:
-    def __init__(self):
-        self.sessions: Dict[str, List[Dict]] = {}
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_messages: int = MAX_MESSAGES, trim_block: int = TRIM_BLOCK):
+        # LRU: most recently appended-to session last
+        self.sessions: "OrderedDict[str, Deque[Message]]" = OrderedDict()
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.trim_block = max(1, min(trim_block, max_messages))
+        # endpoints run on worker threads; guards the OrderedDict and the deques
+        self._lock = threading.Lock()
 
     def new_session(self) -> str:
         sid = str(uuid4())
-        self.sessions[sid] = []
+        with self._lock:
+            self._store(sid, deque())
         return sid
 
     def append(self, session_id: str, role: str, text: str):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        self.sessions[session_id].append({
-            "role": role,
-            "text": text,
-            "ts": datetime.utcnow().isoformat(),
-        })
+        with self._lock:
+            messages = self.sessions.get(session_id)
+            if messages is None:
+                messages = deque()
+                self._store(session_id, messages)
+            else:
+                self.sessions.move_to_end(session_id)
+            messages.append((role, text, time.time()))
+            if len(messages) > self.max_messages:
+                for _ in range(len(messages) - self.max_messages + self.trim_block):
+                    messages.popleft()
+
+    def get(self, session_id: str) -> List[Dict]:
+        with self._lock:
+            messages = list(self.sessions.get(session_id, ()))
+        # timestamps are formatted here rather than on every append
+        return [
+            {"role": role, "text": text, "ts": datetime.utcfromtimestamp(ts).isoformat()}
+            for role, text, ts in messages
+        ]
 
-    def get(self, session_id: str):
-        return self.sessions.get(session_id, [])
+    def session_ids(self) -> List[str]:
+        with self._lock:
+            return list(self.sessions.keys())
 
     def clear(self, session_id: str):
-        self.sessions[session_id] = []
+        with self._lock:
+            self._store(session_id, deque())
+
+    def _store(self, session_id: str, messages: Deque[Message]):
+        self.sessions[session_id] = messages
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+
+class RedisHistoryManager:
+    """Same interface as HistoryManager, but stored in Redis so several uvicorn workers share it.
+
+    Every method does a blocking network round-trip; call it from a worker thread in
+    async code. Each session is a Redis list `session:{sid}` of JSON `[role, text, ts]` entries, trimmed
+    by `trim_block` once longer than `max_messages` and expiring `ttl` seconds after the last append.
+    """
+
+    def __init__(self, client, max_messages: int = MAX_MESSAGES, ttl: int = 86400, trim_block: int = TRIM_BLOCK):
+        self._backend = client
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.trim_block = max(1, min(trim_block, max_messages))
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def new_session(self) -> str:
+        # Redis has no empty lists; the session appears on its first append
+        return str(uuid4())
+
+    def append(self, session_id: str, role: str, text: str):
+        key = self._key(session_id)
+        pipe = self._backend.pipeline()
+        pipe.rpush(key, json.dumps((role, text, time.time())))
+        pipe.expire(key, self.ttl)
+        length, _ = pipe.execute()
+        if length > self.max_messages:
+            self._backend.ltrim(key, -(self.max_messages - self.trim_block), -1)
+
+    def get(self, session_id: str) -> List[Dict]:
+        messages = (json.loads(m) for m in self._backend.lrange(self._key(session_id), 0, -1))
+        return [
+            {"role": role, "text": text, "ts": datetime.utcfromtimestamp(ts).isoformat()}
+            for role, text, ts in messages
+        ]
+
+    def session_ids(self) -> List[str]:
+        return [k.decode().split(":", 1)[1] for k in self._backend.scan_iter(match="session:*")]
+
+    def clear(self, session_id: str):
+        self._backend.delete(self._key(session_id))
+
+
+def _create_history():
+    """Use Redis when HISTORY_REDIS_URL is set (and redis is installed), else in-process memory."""
+    url = os.getenv("HISTORY_REDIS_URL")
+    if url:
+        try:
+            import redis
+            client = redis.Redis.from_url(url)
+            # from_url does not connect; ping so an unreachable server falls back to memory
+            client.ping()
+            return RedisHistoryManager(client, ttl=int(os.getenv("HISTORY_TTL_SECONDS", "86400")))
+        except Exception as e:
+            logger.warning("Could not use Redis history at %s, falling back to memory: %s", url, e)
+    return HistoryManager()
 
 # singleton
-history = HistoryManager()
+history = _create_history()
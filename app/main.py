@@ -1,15 +1,73 @@
+# pin this worker's cores before importing anything that starts threads (numpy/torch
+# pools, model loaders); threads created afterwards inherit the affinity
+from .cpu import pin_worker
+pin_worker()
+
 import os
 import io
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse, RedirectResponse
+import json
+import logging
+import shutil
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header
+from fastapi.responses import StreamingResponse, RedirectResponse, Response
 from pydantic import BaseModel
 import tempfile
 
 from .history import history
-from .services import stt_service, llm_service, tts_service
+from .services import stt_service, llm_service, tts_service, semantic_cache
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Langchain-like Chat with STT/TTS")
 
+# worker threads for miscellaneous blocking work (file copies, semantic cache) dispatched via asyncio.to_thread
+THREADPOOL_MAX_WORKERS = int(os.getenv("THREADPOOL_MAX_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+
+
+# one bounded pool per backend so a long LLM generation cannot hold up STT/TTS work
+# STT is sized by STT_NUM_WORKERS, the number of parallel transcriptions the model accepts
+STT_POOL = ThreadPoolExecutor(max_workers=stt_service.num_workers if stt_service else 2, thread_name_prefix="stt")
+LLM_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_POOL_WORKERS", "1")), thread_name_prefix="llm")
+TTS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("TTS_POOL_WORKERS", "4")), thread_name_prefix="tts")
+
+
+async def _run_in(pool: ThreadPoolExecutor, fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+@app.on_event("startup")
+async def configure_executor():
+    """Size the default executor so one slow whisper/LLM call cannot starve the pool."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=THREADPOOL_MAX_WORKERS))
+
+
+@app.on_event("startup")
+async def warmup_services():
+    """Load and prewarm the STT, LLM, TTS and embedding models in parallel instead of one after another."""
+    await asyncio.gather(*(
+        asyncio.to_thread(service.warmup)
+        for service in (stt_service, llm_service, tts_service, semantic_cache)
+        if service is not None
+    ))
+
+
+@app.on_event("shutdown")
+async def save_semantic_cache():
+    if semantic_cache:
+        await asyncio.to_thread(semantic_cache.save)
+
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    for pool in (STT_POOL, LLM_POOL, TTS_POOL):
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# uploads are decoded in memory; set DEBUG_SAVE_UPLOADS=1 to also keep them in a temp file
+DEBUG_SAVE_UPLOADS = os.getenv("DEBUG_SAVE_UPLOADS", "0") == "1"
+
 # store the last STT uploaded temp file path for debugging (optional, restricted)
 last_stt_saved_path: str | None = None
 
@@ -22,6 +80,15 @@ async def root():
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 STATIC_DIR = os.path.join(BASE_DIR, "web")
 
+# directories the debug endpoints may read from, with a trailing separator, computed once
+ALLOWED_DIRS = tuple(os.path.abspath(d) + os.sep for d in (BASE_DIR, tempfile.gettempdir()))
+
+
+def _allowed(path: str) -> bool:
+    """True if `path` is one of ALLOWED_DIRS or inside one of them."""
+    ap = os.path.abspath(path)
+    return any(ap == d[:-1] or ap.startswith(d) for d in ALLOWED_DIRS)
+
 from fastapi.staticfiles import StaticFiles
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
@@ -29,28 +96,36 @@ class ChatRequest(BaseModel):
     text: str
     session_id: str | None = None
     tts: bool = False
+    stream: bool = False
+
+def _save_upload(src, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(src, tmp, length=65536)
+    src.seek(0)
+    return tmp.name
+
 
 @app.post("/api/stt")
 async def stt_endpoint(audio: UploadFile = File(...)):
-    # save to a temporary file
-    suffix = os.path.splitext(audio.filename)[1] or ".wav"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        data = await audio.read()
-        tmp.write(data)
-        tmp_path = tmp.name
-    # record last saved path for quick debugging endpoint
-    global last_stt_saved_path
-    last_stt_saved_path = tmp_path
+    tmp_path = None
+    if DEBUG_SAVE_UPLOADS:
+        # keep a copy on disk so /api/last_stt and /api/debug_transcribe_last can inspect it
+        suffix = os.path.splitext(audio.filename)[1] or ".wav"
+        tmp_path = await asyncio.to_thread(_save_upload, audio.file, suffix)
+        # record last saved path for quick debugging endpoint
+        global last_stt_saved_path
+        last_stt_saved_path = tmp_path
     try:
-        transcription = stt_service.transcribe_file(tmp_path)
+        # decode straight from the upload's spooled file instead of copying it into one bytes object
+        samples = await _run_in(STT_POOL, stt_service.load_audio, audio.file)
+        res = await _run_in(STT_POOL, stt_service.transcribe_audio, samples)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if res.get("error"):
+        raise HTTPException(status_code=500, detail="Local whisper transcription failed: " + res["error"])
+    transcription = res.get("text", "")
     # return diagnostic info to help debugging client recording issues
-    file_size = None
-    try:
-        file_size = os.path.getsize(tmp_path)
-    except Exception:
-        file_size = None
+    file_size = audio.size
     return {"text": transcription, "file_size": file_size, "file_path": tmp_path}
 
 
@@ -64,9 +139,7 @@ async def get_last_stt():
         raise HTTPException(status_code=404, detail='no stt file recorded yet')
 
     abs_path = os.path.abspath(last_stt_saved_path)
-    allowed_dirs = [BASE_DIR, tempfile.gettempdir()]
-    allowed = any(abs_path.startswith(os.path.abspath(d) + os.sep) or abs_path == os.path.abspath(d) for d in allowed_dirs)
-    if not allowed:
+    if not _allowed(abs_path):
         raise HTTPException(status_code=403, detail='recorded path not allowed')
 
     size = None
@@ -93,16 +166,14 @@ async def debug_transcribe(req: DebugTranscribeRequest):
         raise HTTPException(status_code=400, detail="path is required")
 
     abs_path = os.path.abspath(path)
-    allowed_dirs = [BASE_DIR, tempfile.gettempdir()]
-    allowed = any(abs_path.startswith(os.path.abspath(d) + os.sep) or abs_path == os.path.abspath(d) for d in allowed_dirs)
-    if not allowed:
+    if not _allowed(abs_path):
         raise HTTPException(status_code=403, detail="path not allowed; must be inside project directory or temp dir")
 
     if not os.path.exists(abs_path):
         raise HTTPException(status_code=404, detail="file not found")
 
     try:
-        res = stt_service.transcribe_file_verbose(abs_path)
+        res = await _run_in(STT_POOL, stt_service.transcribe_file_verbose, abs_path, True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -125,14 +196,12 @@ async def debug_transcribe_last():
     if not last_stt_saved_path:
         raise HTTPException(status_code=404, detail='no stt file recorded yet')
     abs_path = os.path.abspath(last_stt_saved_path)
-    allowed_dirs = [BASE_DIR, tempfile.gettempdir()]
-    allowed = any(abs_path.startswith(os.path.abspath(d) + os.sep) or abs_path == os.path.abspath(d) for d in allowed_dirs)
-    if not allowed:
+    if not _allowed(abs_path):
         raise HTTPException(status_code=403, detail='recorded path not allowed')
     if not os.path.exists(abs_path):
         raise HTTPException(status_code=404, detail='file not found')
     try:
-        res = stt_service.transcribe_file_verbose(abs_path)
+        res = await _run_in(STT_POOL, stt_service.transcribe_file_verbose, abs_path, True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     try:
@@ -142,31 +211,119 @@ async def debug_transcribe_last():
         pass
     return res
 
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _log_producer_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Chat stream producer failed", exc_info=future.exception())
+
+
+async def _stream_chat(sid: str, text: str, hist: list, cache_vec=None):
+    """Bridge the blocking LLM token generator to an async SSE stream.
+
+    The generator runs on a worker thread and feeds an asyncio.Queue; frames are
+    `{"session_id"}` first, then `{"token"}` per token, then `{"done", "assistant"}`.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def produce():
+        tokens = None
+        try:
+            # a request abandoned while queued behind another generation skips the prefill
+            if cancelled.is_set():
+                return
+            tokens = llm_service.stream(text, sid, hist)
+            for token in tokens:
+                if cancelled.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, token)
+        finally:
+            if tokens is not None:
+                tokens.close()
+            # always end the stream, even if generation failed to start
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    producer = loop.run_in_executor(LLM_POOL, produce)
+    producer.add_done_callback(_log_producer_error)
+    try:
+        yield _sse({"session_id": sid})
+        parts = []
+        while (token := await queue.get()) is not None:
+            parts.append(token)
+            yield _sse({"token": token})
+        assistant_text = "".join(parts).strip()
+        await asyncio.to_thread(history.append, sid, "assistant", assistant_text)
+        await _remember_reply(cache_vec, text, assistant_text)
+        yield _sse({"done": True, "session_id": sid, "assistant": assistant_text})
+    finally:
+        # client went away or the stream finished; stop the worker thread either way
+        cancelled.set()
+
+
+async def _cached_stream(sid: str, assistant_text: str):
+    yield _sse({"session_id": sid})
+    yield _sse({"token": assistant_text})
+    yield _sse({"done": True, "session_id": sid, "assistant": assistant_text})
+
+
+async def _remember_reply(cache_vec, prompt: str, assistant_text: str):
+    if cache_vec is not None and assistant_text and llm_service.ready:
+        await asyncio.to_thread(semantic_cache.add, cache_vec, prompt, assistant_text)
+
+
 @app.post("/api/chat")
 async def chat_endpoint(req: ChatRequest):
+    if llm_service is None:
+        raise HTTPException(status_code=503, detail="LLM service is not available")
+    # history may be Redis-backed, so every history call goes through a worker thread
     sid = req.session_id or history.new_session()
-    history.append(sid, "user", req.text)
-    assistant_text = llm_service.generate(req.text, history.get(sid))
-    history.append(sid, "assistant", assistant_text)
+    # only opening turns are cached: later replies depend on the conversation so far
+    cache_vec = None
+    cached_text = None
+    if semantic_cache and semantic_cache.enabled and not await asyncio.to_thread(history.get, sid):
+        cache_vec = await asyncio.to_thread(semantic_cache.embed, req.text)
+        cached_text = await asyncio.to_thread(semantic_cache.lookup, cache_vec)
+    await asyncio.to_thread(history.append, sid, "user", req.text)
+
+    if cached_text is not None:
+        await asyncio.to_thread(history.append, sid, "assistant", cached_text)
+        if req.stream and not req.tts:
+            return StreamingResponse(_cached_stream(sid, cached_text), media_type="text/event-stream")
+        assistant_text = cached_text
+    else:
+        hist = await asyncio.to_thread(history.get, sid)
+        if req.stream and not req.tts:
+            return StreamingResponse(_stream_chat(sid, req.text, hist, cache_vec), media_type="text/event-stream")
+        assistant_text = await _run_in(LLM_POOL, llm_service.generate, req.text, sid, hist)
+        await asyncio.to_thread(history.append, sid, "assistant", assistant_text)
+        await _remember_reply(cache_vec, req.text, assistant_text)
 
     result = {"session_id": sid, "assistant": assistant_text}
 
     if req.tts:
-        audio_bytes = tts_service.synthesize(assistant_text)
+        audio_bytes = await _run_in(TTS_POOL, tts_service.synthesize, assistant_text)
         return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/mpeg")
 
     return result
 
 @app.get("/api/tts")
-async def tts_endpoint(text: str):
-    audio_bytes = tts_service.synthesize(text)
-    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/mpeg")
+async def tts_endpoint(text: str, if_none_match: str | None = Header(None)):
+    # the ETag is the TTS cache key, so replays can be answered without synthesizing
+    etag = f'"{tts_service.cache_key(text)}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    audio_bytes = await _run_in(TTS_POOL, tts_service.synthesize, text)
+    return StreamingResponse(io.BytesIO(audio_bytes), media_type="audio/mpeg", headers={"ETag": etag})
 
 @app.get("/api/history")
 async def get_history(session_id: str | None = None):
     if session_id is None:
-        return {"sessions": list(history.sessions.keys())}
-    return {"session_id": session_id, "history": history.get(session_id)}
+        return {"sessions": await asyncio.to_thread(history.session_ids)}
+    return {"session_id": session_id, "history": await asyncio.to_thread(history.get, session_id)}
 
 @app.get("/api/ping")
 async def ping():
@@ -19,5 +19,6 @@ def _import_service(name: str):
 stt_service = _import_service("stt_service")
 llm_service = _import_service("llm_service")
 tts_service = _import_service("tts_service")
+semantic_cache = _import_service("semantic_cache")
 
-__all__ = ["stt_service", "llm_service", "tts_service"]
+__all__ = ["stt_service", "llm_service", "tts_service", "semantic_cache"]
@@ -1,17 +1,24 @@
 import os
 import logging
-from typing import List
+import threading
+from collections import OrderedDict
+from typing import Iterator, List
 
-# Try to import ctransformers for GGUF format support
-_HAS_CTRANSFORMERS = False
+from ..cpu import worker_threads
+
+# Try to import llama-cpp-python for GGUF format support
+_HAS_LLAMA_CPP = False
 try:
-    from ctransformers import AutoModelForCausalLM
-    _HAS_CTRANSFORMERS = True
+    from llama_cpp import Llama
+    _HAS_LLAMA_CPP = True
 except Exception:
     pass
 
 logger = logging.getLogger(__name__)
 
+# sessions whose rendered history text is kept for incremental prompt building
+PREFIX_CACHE_SESSIONS = 1024
+
 
 class LLMService:
     """Local LLM service. Loads a local model path (Hugging Face format) and runs generation.
@@ -20,8 +27,17 @@ class LLMService:
     - LOCAL_MODEL_PATH: path or model id to load from (defaults to 'mistralai/Mistral-7B-Instruct')
     - LOCAL_MODEL_DEVICE: 'cpu' or 'cuda' (auto-detected if not set)
     - LOCAL_MAX_NEW_TOKENS: default max new tokens for generation
+    - LLM_THREADS: CPU threads used for inference (defaults to this worker's share of
+      the cores, or OMP_NUM_THREADS)
+    - GPU_LAYERS: number of layers to offload to the GPU (defaults to 0, CPU only)
+    - LLM_KV_CACHE_SESSIONS: number of sessions whose KV cache is kept between turns
+      (defaults to 4; each saved state holds the session's full KV cache, ~100+ MB for
+      long 7B conversations)
 
-    If transformers/torch are not installed, generate() falls back to a simple echo.
+    A Q4_K_M (or Q5_K_M) quant of the GGUF is recommended: it halves the weight bytes
+    read per token compared to Q8, which is the dominant cost of CPU inference.
+
+    If llama-cpp-python is not installed, generate() falls back to a simple echo.
     """
 
     def __init__(self):
@@ -31,11 +47,46 @@ class LLMService:
             self.model_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../..", self.model_path))
         
         self.max_new_tokens = int(os.getenv("LOCAL_MAX_NEW_TOKENS", "512"))
+        self.threads = int(os.getenv("LLM_THREADS", str(worker_threads())))
+        self.gpu_layers = int(os.getenv("GPU_LAYERS", "0"))
+        self.max_kv_sessions = int(os.getenv("LLM_KV_CACHE_SESSIONS", "4"))
         self.model = None
         self._ready = False
+        # the model is loaded once, by warmup() at app startup or on first use
+        self._load_attempted = False
+        # saved llama.cpp states per session, most recently used last
+        self._kv_states: OrderedDict = OrderedDict()
+        # the llama.cpp context is not thread-safe and holds a single KV cache
+        self._lock = threading.Lock()
+        # session_id -> (messages covered, last message covered, rendered history text)
+        self._prefix_cache: OrderedDict = OrderedDict()
+        self._prefix_lock = threading.Lock()
+
+    def load(self):
+        """Load the GGUF model once; a failed load is not retried (replies fall back to echo)."""
+        with self._lock:
+            if self._load_attempted:
+                return
+            self._load_attempted = True
+            self._load_model()
+
+    def warmup(self):
+        """Load the model and generate a single token so the first real request does not
+        pay for mmap page faults and buffer allocation."""
+        self.load()
+        if not self.ready:
+            return
+        try:
+            with self._lock:
+                self.model("hi", max_tokens=1)
+                self.model.reset()
+            logger.info("LLM warmed up")
+        except Exception as e:
+            logger.warning("LLM warmup failed: %s", e)
 
-        if not _HAS_CTRANSFORMERS:
-            logger.warning("ctransformers not available — LLM will fallback to echo responses. Install with: pip install ctransformers")
+    def _load_model(self):
+        if not _HAS_LLAMA_CPP:
+            logger.warning("llama-cpp-python not available — LLM will fallback to echo responses. Install with: pip install llama-cpp-python")
             return
 
         logger.info(f"Loading local GGUF model: %s", self.model_path)
@@ -44,57 +95,114 @@ class LLMService:
                 raise FileNotFoundError(f"Model file not found: {self.model_path}")
 
             # Load the GGUF model - uses CPU by default, optimized for inference
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_path,
-                model_type="mistral",
-                context_length=4096,  # Mistral's context window
-                gpu_layers=0  # Force CPU as requested
+            self.model = Llama(
+                model_path=self.model_path,
+                n_ctx=4096,  # Mistral's context window
+                n_gpu_layers=self.gpu_layers,  # 0 keeps everything on the CPU
+                n_threads=self.threads,
+                n_threads_batch=self.threads,
+                n_batch=512,  # prompt tokens evaluated per forward pass
+                verbose=False,
             )
             self._ready = True
-            logger.info("Model loaded successfully (CPU)")
+            logger.info("Model loaded successfully (threads=%d, gpu_layers=%d)", self.threads, self.gpu_layers)
         except Exception as e:
             logger.exception("Failed to load GGUF model: %s", e)
             self._ready = False
 
-    def generate(self, prompt: str, history: List[dict] | None = None) -> str:
+    @property
+    def ready(self) -> bool:
+        """True when a local model is loaded (False means replies are echo fallbacks)."""
+        return _HAS_LLAMA_CPP and self._ready
+
+    def generate(self, prompt: str, session_id: str | None = None, history: List[dict] | None = None) -> str:
         """Generate text from prompt + history. Returns assistant text string.
 
-        This keeps the same simple interface as before.
+        This buffers `stream()` into a single string for callers that do not stream.
+        Only generated tokens are streamed (the prompt is never echoed back), so no
+        post-processing of the reply is needed.
+        """
+        return "".join(self.stream(prompt, session_id, history)).strip()
+
+    def stream(self, prompt: str, session_id: str | None = None, history: List[dict] | None = None) -> Iterator[str]:
+        """Yield the assistant reply token by token.
+
+        When `session_id` is given, the KV cache left by the session's previous turn is
+        restored first; llama.cpp then only prefills the tokens past the shared prefix
+        (the new user turn) instead of the whole conversation.
         """
-        full_prompt = self._build_prompt(prompt, history)
+        full_prompt = self._build_prompt(session_id, prompt, history)
+        self.load()
 
-        if not _HAS_CTRANSFORMERS or not self._ready:
+        if not _HAS_LLAMA_CPP or not self._ready:
             # fallback simple echo responder
             logger.warning("Local model not available, returning fallback echo response")
-            return "Echo: " + prompt
+            yield "Echo: " + prompt
+            return
 
         try:
-            # Generate with ctransformers - it handles tokenization internally
-            response = self.model(
-                full_prompt,
-                max_new_tokens=self.max_new_tokens,
-                temperature=0.7,
-                stop=["user:", "User:", "</s>"],  # Stop at these tokens
-                stream=False  # Get complete response
-            )
-            # ctransformers returns the full response including the prompt
-            # try to extract just the assistant's response
-            text = response.split("assistant:")[-1].strip()
-            return text
+            with self._lock:
+                self._restore_state(session_id)
+                # Generate with llama.cpp - it handles tokenization internally
+                for chunk in self.model(
+                    full_prompt,
+                    max_tokens=self.max_new_tokens,
+                    temperature=0.7,
+                    stop=["user:", "User:", "</s>"],  # Stop at these tokens
+                    stream=True,
+                ):
+                    yield chunk["choices"][0]["text"]
+                # only reached when the reply completed; an abandoned stream keeps the old state
+                self._save_state(session_id)
         except Exception as e:
             logger.exception("Generation error: %s", e)
-            return ""
-
-    def _build_prompt(self, prompt: str, history: List[dict] | None):
-        parts = []
-        if history:
-            for item in history:
-                role = item.get("role")
-                text = item.get("text")
-                parts.append(f"{role}: {text}")
-        parts.append("user: " + prompt)
-        parts.append("assistant:")
-        return "\n".join(parts)
 
+    def _restore_state(self, session_id: str | None):
+        state = self._kv_states.get(session_id) if session_id else None
+        if state is None:
+            self.model.reset()
+            return
+        self._kv_states.move_to_end(session_id)
+        self.model.load_state(state)
+
+    def _save_state(self, session_id: str | None):
+        if not session_id or self.max_kv_sessions <= 0:
+            return
+        self._kv_states[session_id] = self.model.save_state()
+        self._kv_states.move_to_end(session_id)
+        while len(self._kv_states) > self.max_kv_sessions:
+            self._kv_states.popitem(last=False)
+
+    def _build_prompt(self, session_id: str | None, prompt: str, history: List[dict] | None):
+        history = history or []
+        end = len(history)
+        # the chat endpoint records the user turn before generating; don't render it twice
+        if end and history[-1].get("role") == "user" and history[-1].get("text") == prompt:
+            end -= 1
+        return self._history_text(session_id, history, end) + f"user: {prompt}\nassistant:"
+
+    def _history_text(self, session_id: str | None, history: List[dict], end: int) -> str:
+        """Render history[:end] as "role: text" lines, reusing the session's cached rendering.
+
+        Only messages added since the previous turn are formatted. If the cached prefix no
+        longer matches (history was trimmed or cleared) the text is rebuilt from scratch.
+        """
+        def render(start: int) -> str:
+            return "".join(f"{history[i].get('role')}: {history[i].get('text')}\n" for i in range(start, end))
+
+        if not session_id:
+            return render(0)
+
+        with self._prefix_lock:
+            cached = self._prefix_cache.get(session_id)
+            if cached and cached[0] <= end and (cached[0] == 0 or history[cached[0] - 1] == cached[1]):
+                text = cached[2] + render(cached[0])
+            else:
+                text = render(0)
+            self._prefix_cache[session_id] = (end, history[end - 1] if end else None, text)
+            self._prefix_cache.move_to_end(session_id)
+            while len(self._prefix_cache) > PREFIX_CACHE_SESSIONS:
+                self._prefix_cache.popitem(last=False)
+        return text
 
 llm_service = LLMService()
@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+
+# Optional dependencies: sentence-transformers for embeddings and faiss for the index
+_HAS_DEPS = False
+try:
+    import numpy as np
+    import faiss
+    from sentence_transformers import SentenceTransformer
+    _HAS_DEPS = True
+except Exception:
+    pass
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+
+
+class SemanticCache:
+    """Cache of LLM replies keyed by prompt embedding similarity.
+
+    Prompts are embedded with a small sentence-transformers model and stored L2-normalized
+    in a FAISS inner-product index, so a search score is the cosine similarity. A lookup
+    returns the cached reply of the nearest prompt when its score exceeds the threshold.
+
+    Controls via environment variables:
+    - SEMANTIC_CACHE_MODEL: embedding model (defaults to 'sentence-transformers/all-MiniLM-L6-v2')
+    - SEMANTIC_CACHE_THRESHOLD: minimum cosine similarity for a hit (defaults to 0.92)
+    - SEMANTIC_CACHE_DIR: where the index is persisted on shutdown (defaults to 'cache/semantic')
+    - SEMANTIC_CACHE_MAX_ENTRIES: maximum cached prompts (defaults to 10000); once exceeded
+      the oldest tenth is dropped
+
+    The embedding model is loaded by load()/warmup() at app startup, or on first use.
+
+    If sentence-transformers/faiss are not installed the cache is disabled and every
+    lookup misses.
+    """
+
+    def __init__(self):
+        self.model_name = os.getenv("SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+        self.threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+        self.cache_dir = os.getenv("SEMANTIC_CACHE_DIR", "cache/semantic")
+        if not os.path.isabs(self.cache_dir):
+            self.cache_dir = os.path.join(BASE_DIR, self.cache_dir)
+        self.max_entries = max(1, int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "10000")))
+        self.model = None
+        self.index = None
+        # parallel to the index rows, oldest first: [(prompt, response), ...]
+        self.entries: list = []
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._load_attempted = False
+
+        if not _HAS_DEPS:
+            logger.warning("sentence-transformers/faiss not available — semantic cache disabled")
+
+    @property
+    def enabled(self) -> bool:
+        """False when the dependencies are missing or loading failed."""
+        if not _HAS_DEPS:
+            return False
+        return not self._load_attempted or (self.model is not None and self.index is not None)
+
+    def load(self):
+        """Load the embedding model and the persisted index once; a failure disables the cache."""
+        with self._load_lock:
+            if self._load_attempted or not _HAS_DEPS:
+                return
+            self._load_attempted = True
+            try:
+                self.model = SentenceTransformer(self.model_name, device="cpu")
+                self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+                self._load()
+            except Exception as e:
+                logger.warning("Semantic cache: failed to initialise: %s", e)
+                self.model = None
+                self.index = None
+
+    def warmup(self):
+        self.load()
+        if self.model is None:
+            return
+        try:
+            self.model.encode(["warmup"], normalize_embeddings=True)
+            logger.info("Semantic cache: model '%s' warmed up", self.model_name)
+        except Exception as e:
+            logger.warning("Semantic cache: warmup failed: %s", e)
+
+    def embed(self, text: str):
+        """Return the normalized embedding of `text` as a (1, d) float32 array, or None."""
+        self.load()
+        if self.model is None:
+            return None
+        vec = self.model.encode([text], normalize_embeddings=True)
+        return np.asarray(vec, dtype="float32")
+
+    def lookup(self, vec) -> str | None:
+        """Return the cached reply closest to `vec` if it is similar enough."""
+        if vec is None or self.index is None:
+            return None
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vec, 1)
+            score, idx = float(scores[0][0]), int(ids[0][0])
+            if idx < 0 or score <= self.threshold:
+                return None
+            logger.info("Semantic cache hit (score=%.3f)", score)
+            return self.entries[idx][1]
+
+    def add(self, vec, prompt: str, response: str):
+        if vec is None or self.index is None:
+            return
+        with self._lock:
+            self.index.add(vec)
+            self.entries.append((prompt, response))
+            if len(self.entries) > self.max_entries:
+                # evict in chunks: removing rows from a flat index shifts everything after them
+                self._evict_oldest(len(self.entries) - self.max_entries + self.max_entries // 10)
+
+    def _evict_oldest(self, count: int):
+        count = min(count, len(self.entries))
+        self.index.remove_ids(np.arange(count, dtype="int64"))
+        del self.entries[:count]
+
+    @property
+    def _path(self) -> str:
+        return os.path.join(self.cache_dir, "cache.npz")
+
+    def save(self):
+        """Persist the index and its entries to SEMANTIC_CACHE_DIR.
+
+        Both go into one file that is written under a temporary name and renamed into
+        place, so several workers saving at shutdown never leave a mismatched pair.
+        """
+        if self.index is None:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with self._lock:
+                index_bytes = faiss.serialize_index(self.index)
+                entries_json = json.dumps(self.entries)
+                count = len(self.entries)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, index=index_bytes, entries=np.array(entries_json))
+            os.replace(tmp_path, self._path)
+            tmp_path = None
+            logger.info("Semantic cache: saved %d entries to %s", count, self.cache_dir)
+        except Exception as e:
+            logger.warning("Semantic cache: failed to save: %s", e)
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            return
+        with np.load(self._path, allow_pickle=False) as data:
+            index = faiss.deserialize_index(data["index"])
+            entries = [tuple(e) for e in json.loads(str(data["entries"]))]
+        if index.ntotal != len(entries) or index.d != self.index.d:
+            logger.warning("Semantic cache: persisted index does not match, starting empty")
+            return
+        self.index = index
+        self.entries = entries
+        if len(entries) > self.max_entries:
+            self._evict_oldest(len(entries) - self.max_entries)
+        logger.info("Semantic cache: loaded %d entries", len(self.entries))
+
+
+semantic_cache = SemanticCache()
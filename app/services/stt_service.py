@@ -1,46 +1,153 @@
 import os
 import logging
+import threading
+
+from ..cpu import worker_threads
 
 logger = logging.getLogger(__name__)
 
+# whisper operates on 16 kHz mono audio
+SAMPLE_RATE = 16000
+
 
 class STTService:
+    """Local STT service backed by faster-whisper (CTranslate2).
+
+    Controls via environment variables:
+    - STT_MODEL: whisper model size or path (defaults to 'small')
+    - STT_DEVICE: 'cpu', 'cuda' or 'auto' (default 'auto')
+    - STT_COMPUTE_TYPE: CTranslate2 compute type; defaults to 'int8' on CPU and
+      'int8_float16' on GPU
+    - STT_NUM_WORKERS: number of concurrent transcriptions the model accepts (default 4);
+      the app's STT thread pool is sized from it, so it is the single STT concurrency knob
+    - STT_SILENCE_DB: RMS level (dBFS) below which audio is skipped as silence (default -50)
+    """
+
     def __init__(self):
-        # Try to import and load the whisper model once at service init to avoid
-        # repeated downloads and long per-request startup delays. If whisper is
+        # Construction is cheap; the model is loaded by load()/warmup() at app startup
+        # (in parallel with the other services) or on first use. If faster-whisper is
         # not installed the object will still be created but methods will raise
         # a clear error when used.
         self.model = None
-        self.model_name = "small"
+        self.model_name = os.getenv("STT_MODEL", "small")
+        self.device = os.getenv("STT_DEVICE", "auto")
+        self.num_workers = int(os.getenv("STT_NUM_WORKERS", "4"))
+        # each of the num_workers transcriptions gets its own threads; split the worker's
+        # share between them instead of giving every one all of it
+        self.cpu_threads = int(os.getenv("STT_CPU_THREADS", str(max(1, worker_threads() // self.num_workers))))
+        # recordings quieter than this are treated as silence and never reach the model
+        self.silence_db = float(os.getenv("STT_SILENCE_DB", "-50"))
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        """Load the model once; safe to call from several threads. Raises on failure."""
+        if self.model is None:
+            with self._load_lock:
+                if self.model is None:
+                    self.model = self._load_model()
+        return self.model
+
+    def warmup(self):
+        """Load the model and run a dummy second of silence through it so the first
+        real request does not pay for lazy allocation and page faults."""
+        import numpy as np
+
         try:
-            import whisper
-            try:
-                # load model eagerly to ensure it's available and report errors early
-                self.model = whisper.load_model(self.model_name)
-            except Exception as e:
-                logger.warning("STT: failed to load whisper model '%s' at init: %s", self.model_name, e)
-                self.model = None
+            self.load()
+            segments, _ = self.model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), beam_size=1, language="en")
+            list(segments)
+            logger.info("STT: model '%s' warmed up", self.model_name)
         except Exception as e:
-            logger.warning("STT: whisper package not available: %s", e)
+            logger.warning("STT: failed to load faster-whisper model '%s' at startup: %s", self.model_name, e)
+
+    def _load_model(self):
+        from faster_whisper import WhisperModel
+
+        compute_type = os.getenv("STT_COMPUTE_TYPE") or ("int8_float16" if self._uses_cuda() else "int8")
+        return WhisperModel(
+            self.model_name,
+            device=self.device,
+            compute_type=compute_type,
+            num_workers=self.num_workers,
+            cpu_threads=self.cpu_threads,
+        )
+
+    def _uses_cuda(self) -> bool:
+        if self.device != "auto":
+            return self.device == "cuda"
+        try:
+            import ctranslate2
+            return ctranslate2.get_cuda_device_count() > 0
+        except Exception:
+            return False
+
+    def _transcribe(self, audio) -> dict:
+        """Run the model on a path or decoded array and return text, language and segments."""
+        segments, info = self.model.transcribe(audio, vad_filter=True, beam_size=1)
+        # segments is a lazy generator; iterating it is what actually runs the decoder
+        segs = [{"start": float(s.start), "end": float(s.end), "text": s.text.strip()} for s in segments]
+        return {
+            "text": " ".join(s["text"] for s in segs if s["text"]),
+            "language": info.language,
+            "segments": segs,
+        }
 
     def transcribe_file(self, path: str) -> str:
-        """Transcribe an audio file using a local whisper installation.
+        """Transcribe an audio file using a local faster-whisper installation.
 
-        This implementation no longer uses any hosted API. Install the `whisper` package
-        or another local STT backend and ensure it's available in the environment.
+        This implementation no longer uses any hosted API. Install the `faster-whisper`
+        package and ensure it's available in the environment.
         The function logs the input file path and transcription for easier debugging.
         """
         # Use verbose transcription internally but return only text for backward compatibility
-        res = self.transcribe_file_verbose(path)
+        res = self.transcribe_file_verbose(path, verbose=False)
         if res.get("error"):
             raise RuntimeError("Local whisper transcription failed: " + res["error"])
         return res.get("text", "")
 
-    def transcribe_file_verbose(self, path: str) -> dict:
+    def load_audio(self, source):
+        """Decode an audio file path or binary file-like object to a float32 16 kHz mono numpy array.
+
+        Decoding goes through PyAV, so any container/codec ffmpeg understands works and
+        in-memory uploads (io.BytesIO) never touch the disk.
+        """
+        from faster_whisper import decode_audio
+        return decode_audio(source, sampling_rate=SAMPLE_RATE)
+
+    def transcribe_audio(self, audio) -> dict:
+        """Transcribe one decoded audio array.
+
+        Returns a dict with keys: text, language, segments, model_loaded, error (and
+        `skipped_reason` for silence). Callers bound concurrency themselves; the
+        CTranslate2 model accepts up to STT_NUM_WORKERS of these calls in parallel.
+        """
+        result = {"text": "", "language": None, "segments": [], "model_loaded": False, "error": None}
+        if not self.model:
+            try:
+                self.load()
+            except Exception as e:
+                logger.exception("STT: failed to import/load faster-whisper model on demand")
+                result["error"] = str(e)
+                return result
+
+        result["model_loaded"] = True
+        if self._is_silent(audio):
+            result["skipped_reason"] = "silence"
+            return result
+        try:
+            result.update(self._transcribe(audio))
+        except Exception as e:
+            logger.exception("STT: transcription call failed")
+            result["error"] = str(e)
+        return result
+
+    def transcribe_file_verbose(self, path: str, verbose: bool = False) -> dict:
         """Transcribe a file and return a JSON-serializable dict with details.
 
         Returns keys: text, language, segments (list of {start,end,text}), file_size,
-        model_loaded (bool), error (str or null).
+        model_loaded (bool), error (str or null), and `audio_info` when `verbose` is set.
+        Silent audio returns empty text with `skipped_reason: "silence"`.
+        The file is decoded once and the same samples feed both inspection and the model.
         """
         result = {"text": "", "language": None, "segments": [], "file_size": None, "model_loaded": False, "error": None}
         try:
@@ -50,125 +157,99 @@ class STTService:
             result["file_size"] = size
             logger.info("STT: transcribing file %s (size=%d bytes)", path, size)
 
-            # Attempt a lightweight audio inspection for WAV files to detect silence/codecs
-            try:
-                audio_info = self._inspect_wav(path)
-                result["audio_info"] = audio_info
-            except Exception:
-                # non-fatal; continue to transcription
-                logger.debug("STT: audio inspection skipped or failed for %s", path)
+            audio = self.load_audio(path)
+
+            # Attempt a lightweight audio inspection to detect silence/codecs (debug only)
+            if verbose:
+                try:
+                    audio_info = self._inspect_wav(path, audio)
+                    result["audio_info"] = audio_info
+                except Exception:
+                    # non-fatal; continue to transcription
+                    logger.debug("STT: audio inspection skipped or failed for %s", path)
 
             # ensure we have a model; if not, try to import & load on demand
             if not self.model:
                 try:
-                    import whisper
-                    self.model = whisper.load_model(self.model_name)
+                    self.load()
                 except Exception as e:
-                    logger.exception("STT: failed to import/load whisper model on demand")
+                    logger.exception("STT: failed to import/load faster-whisper model on demand")
                     result["error"] = str(e)
                     return result
 
             result["model_loaded"] = True
+            # a silent recording (e.g. a mic button clicked by accident) skips the model entirely
+            rms_db = result["audio_info"]["rms_db"] if "audio_info" in result else None
+            if self._is_silent(audio, rms_db):
+                logger.info("STT: %s is silent, skipping transcription", path)
+                result["skipped_reason"] = "silence"
+                return result
+
             # perform transcription
             try:
-                res = self.model.transcribe(path)
+                res = self._transcribe(audio)
             except Exception as e:
                 logger.exception("STT: transcription call failed")
                 result["error"] = str(e)
                 return result
 
-            text = res.get("text", "")
-            result["text"] = text
-            result["language"] = res.get("language")
-            segments = res.get("segments") or []
-            # normalize segments to simple list of dicts
-            segs = []
-            for s in segments:
-                try:
-                    segs.append({
-                        "start": float(s.get("start", 0)),
-                        "end": float(s.get("end", 0)),
-                        "text": s.get("text", "").strip(),
-                    })
-                except Exception:
-                    # if segment is a simple string or unexpected shape
-                    segs.append({"start": None, "end": None, "text": str(s)})
-            result["segments"] = segs
-            logger.info("STT: transcription result: %s", repr(text))
+            result.update(res)
+            logger.info("STT: transcription result: %s", repr(res["text"]))
             return result
         except Exception as e:
             logger.exception("Local whisper transcription failed (verbose)")
             result["error"] = str(e)
             return result
 
-    def _inspect_wav(self, path: str) -> dict:
-        """Return simple WAV file diagnostics: channels, sample_rate, duration, rms_db, peak.
+    def _inspect_wav(self, path: str, audio) -> dict:
+        """Return simple audio diagnostics: channels, sample_rate, duration, rms_db, peak.
 
-        This uses the standard library `wave` module and does not require external deps.
-        Works only for uncompressed WAV (PCM) files.
+        Channels and sample rate come from the WAV header (uncompressed WAV only; None
+        otherwise). Levels are computed with NumPy from the already decoded float32
+        samples, so the file is not read a second time.
         """
         info = {"channels": None, "sample_rate": None, "duration": None, "rms_db": None, "peak": None}
         try:
-            import wave, struct, math
-
-            with wave.open(path, 'rb') as wf:
-                channels = wf.getnchannels()
-                sampwidth = wf.getsampwidth()
-                framerate = wf.getframerate()
-                nframes = wf.getnframes()
-                duration = nframes / float(framerate) if framerate else None
-
-                info.update({"channels": channels, "sample_rate": framerate, "duration": duration})
-
-                # Only handle 1 or 2 byte sample widths (8/16-bit). Read in chunks to avoid huge memory.
-                max_amp = float((2 ** (8 * sampwidth - 1)) - 1)
-                sum_squares = 0.0
-                peak = 0.0
-                total_samples = 0
-                chunk = 1024
-                wf.rewind()
-                while True:
-                    frames = wf.readframes(chunk)
-                    if not frames:
-                        break
-                    # interpret samples
-                    if sampwidth == 1:
-                        fmt = f"{len(frames)}B"
-                        vals = struct.unpack(fmt, frames)
-                        # 8-bit WAV is unsigned: convert to signed centered at 128
-                        vals = [v - 128 for v in vals]
-                    elif sampwidth == 2:
-                        fmt = f"<{len(frames)//2}h"
-                        vals = struct.unpack(fmt, frames)
-                    else:
-                        # unsupported width; bail out
-                        raise RuntimeError(f"Unsupported sample width: {sampwidth}")
-
-                    # if multi-channel, vals contains interleaved samples
-                    for v in vals:
-                        total_samples += 1
-                        a = float(v)
-                        sum_squares += a * a
-                        if abs(a) > peak:
-                            peak = abs(a)
-
-                if total_samples > 0:
-                    rms = math.sqrt(sum_squares / total_samples)
-                    # avoid log of zero
-                    if rms <= 0:
-                        rms_db = float('-inf')
-                    else:
-                        rms_db = 20.0 * math.log10(rms / max_amp)
-                    peak_rel = peak / max_amp if max_amp else None
-                else:
-                    rms_db = float('-inf')
-                    peak_rel = None
-
-                info.update({"rms_db": rms_db, "peak": peak_rel})
-                return info
+            import wave
+
+            try:
+                with wave.open(path, 'rb') as wf:
+                    framerate = wf.getframerate()
+                    info.update({
+                        "channels": wf.getnchannels(),
+                        "sample_rate": framerate,
+                        "duration": wf.getnframes() / float(framerate) if framerate else None,
+                    })
+            except (wave.Error, EOFError):
+                # not a PCM WAV; fall back to the decoded length
+                info["duration"] = len(audio) / float(SAMPLE_RATE)
+
+            rms_db, peak_rel = self._levels(audio)
+            info.update({"rms_db": rms_db, "peak": peak_rel})
+            return info
         except Exception as e:
             logger.debug("STT: _inspect_wav failed: %s", e)
             raise
 
+    @staticmethod
+    def _levels(audio) -> tuple:
+        """Return (rms_db, peak) of decoded float32 samples; rms_db is -inf for silence/empty."""
+        import math
+        import numpy as np
+
+        # decoded samples are float32 in [-1, 1], so full scale is 1.0.
+        # dot/max/min each make one pass over the buffer without temporary arrays.
+        if audio.size == 0:
+            return float('-inf'), None
+        rms = math.sqrt(float(np.dot(audio, audio)) / audio.size)
+        # avoid log of zero
+        rms_db = 20.0 * math.log10(rms) if rms > 0 else float('-inf')
+        return rms_db, float(max(audio.max(), -audio.min()))
+
+    def _is_silent(self, audio, rms_db: float | None = None) -> bool:
+        if rms_db is None:
+            rms_db = self._levels(audio)[0]
+        return rms_db < self.silence_db
+
 
 stt_service = STTService()
@@ -1,8 +1,15 @@
 import os
 import io
-import tempfile
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
 
 PREFERRED_TTS = os.getenv("PREFERRED_TTS", "gtts")
+# upper bound on the bytes of synthesized audio kept in memory
+TTS_CACHE_MB = int(os.getenv("TTS_CACHE_MB", "64"))
 
 
 class TTSService:
@@ -10,6 +17,14 @@ class TTSService:
         self.engine = PREFERRED_TTS.lower()
         # try to import Coqui TTS if requested
         self.coqui_available = False
+        # Coqui model instance, created on first use and reused across requests
+        self._coqui = None
+        # LRU of cache_key -> MP3 bytes, bounded by total size rather than entry count
+        self._cache: OrderedDict[str, bytes] = OrderedDict()
+        self._cache_bytes = 0
+        self._max_bytes = TTS_CACHE_MB * 1024 * 1024
+        self._cache_lock = threading.Lock()
+        self._load_lock = threading.Lock()
         if self.engine == "coqui":
             try:
                 from TTS.api import TTS  # type: ignore
@@ -18,20 +33,61 @@ class TTSService:
             except Exception:
                 self.coqui_available = False
 
+    def load(self):
+        """Create the Coqui model if that engine is in use; gTTS has nothing to load."""
+        if self.engine == "coqui" and self.coqui_available and self._coqui is None:
+            with self._load_lock:
+                if self._coqui is None:
+                    self._coqui = self.TTS()
+
+    def warmup(self):
+        # synthesizing is skipped: for gTTS it would be a network round-trip
+        try:
+            self.load()
+        except Exception as e:
+            logger.warning("TTS warmup failed: %s", e)
+
+    def cache_key(self, text: str) -> str:
+        """Return the cache key (also used as the HTTP ETag) for `text` on the active engine."""
+        engine = "coqui" if self.engine == "coqui" and self.coqui_available else "gtts"
+        return hashlib.blake2b(f"{engine}\0{text}".encode(), digest_size=16).hexdigest()
+
     def synthesize(self, text: str) -> bytes:
         """Return MP3 bytes of the synthesized text.
 
-        Uses Coqui TTS if available and configured; otherwise uses gTTS.
+        Uses Coqui TTS if available and configured; otherwise uses gTTS. Results are
+        cached by `cache_key(text)` up to TTS_CACHE_MB megabytes.
         """
+        key = self.cache_key(text)
+        with self._cache_lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+
+        data = self._synthesize(text)
+
+        if len(data) <= self._max_bytes:
+            with self._cache_lock:
+                if key not in self._cache:
+                    self._cache[key] = data
+                    self._cache_bytes += len(data)
+                while self._cache_bytes > self._max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted)
+        return data
+
+    def _synthesize(self, text: str) -> bytes:
         if self.engine == "coqui" and self.coqui_available:
-            # Use Coqui TTS to synthesize to file then read as bytes
-            tts = self.TTS()
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp:
-                path = tmp.name
-            tts.tts_to_file(text=text, file_path=path)
-            with open(path, "rb") as f:
-                data = f.read()
-            return data
+            # Use Coqui TTS to synthesize a waveform and encode it to MP3 in memory
+            import soundfile as sf
+
+            self.load()
+            wav = self._coqui.tts(text=text)
+            sample_rate = self._coqui.synthesizer.output_sample_rate
+            mp3_fp = io.BytesIO()
+            sf.write(mp3_fp, wav, sample_rate, format="MP3")
+            return mp3_fp.getvalue()
 
         # fallback: gTTS
         try:
@@ -0,0 +1,25 @@
+"""Multi-worker entry point: `python run.py`.
+
+WEB_CONCURRENCY sets the number of uvicorn worker processes (default 2); each worker
+loads its own models and sizes their thread pools to its share of the cores.
+"""
+import os
+import logging
+
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+    # worker processes inherit this, so every service sees the same worker count
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    if workers > 1 and os.environ.pop("UVICORN_WORKER_ID", None) is not None:
+        # every worker would inherit the same id and pin to the same cores
+        logger.warning("Ignoring UVICORN_WORKER_ID with multiple workers; launch one process per worker to pin cores")
+    uvicorn.run(
+        "app.main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+    )
@@ -177,16 +177,20 @@ async function processMessage(text) {
     const chatRes = await fetch('/api/chat', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ text, session_id: sessionId })
+      body: JSON.stringify({ text, session_id: sessionId, stream: true })
     });
-    const chatData = await chatRes.json();
-    sessionId = chatData.session_id;
-    document.getElementById('sessionId').innerText = sessionId;
+    if (!chatRes.ok) throw new Error(`${chatRes.status} ${chatRes.statusText}`);
 
-    addHistory('assistant', chatData.assistant);
+    // render tokens as they arrive over server-sent events
+    const assistantElem = addHistory('assistant', '');
+    const assistantContent = assistantElem.querySelector('.content');
+    const assistantText = await readChatStream(chatRes, (token) => {
+      assistantContent.textContent += token;
+    });
+    assistantContent.textContent = assistantText;
 
     // fetch and play TTS
-    const ttsResp = await fetch(`/api/tts?text=${encodeURIComponent(chatData.assistant)}`);
+    const ttsResp = await fetch(`/api/tts?text=${encodeURIComponent(assistantText)}`);
     const audioBlob = await ttsResp.blob();
     player.src = URL.createObjectURL(audioBlob);
     await player.play();
@@ -200,6 +204,33 @@ async function processMessage(text) {
   }
 }
 
+// Read the `data: {...}` frames of a streamed /api/chat response; returns the final assistant text.
+async function readChatStream(res, onToken) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let finalText = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      if (!frame.startsWith('data: ')) continue;
+      const data = JSON.parse(frame.slice(6));
+      if (data.session_id) {
+        sessionId = data.session_id;
+        document.getElementById('sessionId').innerText = sessionId;
+      }
+      if (data.token) onToken(data.token);
+      if (data.done) finalText = data.assistant;
+    }
+  }
+  return finalText;
+}
+
 sendTextBtn.onclick = () => {
   const text = textInput.value.trim();
   if (!text) return;